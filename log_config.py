@@ -0,0 +1,26 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+log_queue = queue.SimpleQueue()
+log_listener = None
+
+# Records are handed to a queue on the calling thread and written to stderr by a
+# background listener, so request handlers never block on stream I/O.
+def get_logger(name, default_level="WARNING"):
+    global log_listener
+    if log_listener is None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        log_listener = logging.handlers.QueueListener(log_queue, handler)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        logger.propagate = False
+    logger.setLevel(os.getenv("LOG_LEVEL", default_level).upper())
+    return logger
@@ -1,21 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
 from pydantic import BaseModel
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from pymongo import MongoClient
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from xml.sax.saxutils import escape
+from urllib.parse import quote
+from pymongo import AsyncMongoClient, ReturnDocument
+from pymongo.write_concern import WriteConcern
 from datetime import datetime
 from google import genai
+from google.genai import types
 from uuid import uuid4
-import tempfile
-import requests
-import json
+from cachetools import TTLCache
+from hashlib import sha256
+import threading
+import asyncio
+import io
+import re
+import httpx
+import orjson
 import uvicorn
-from textwrap import wrap
 from dotenv import load_dotenv
 load_dotenv()
 import os
+from log_config import get_logger
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MONGO_URI = os.getenv("MONGO_URI")
@@ -23,15 +34,37 @@ DASHBOARD_API = "https://carapi-2goc.onrender.com/get-dashboard/"
 SERVICE_API = "https://ey-model-prediction-1.onrender.com/start-automated-service"
 DB_NAME = "techathon_db"
 MODEL_NAME = "gemini-3-flash-preview"
+BATCH_MAX_SIZE = 8
+BATCH_MAX_WAIT = 0.05  # seconds to wait for more analyses before calling Gemini
+HEALTHY_MIN_SAMPLES = 20  # healthy LLM verdicts needed before a model's envelope is trusted
 
 client = genai.Client(api_key=GEMINI_API_KEY)
-mongo_client = MongoClient(MONGO_URI)
+mongo_client = AsyncMongoClient(
+    MONGO_URI,
+    maxPoolSize=200,
+    minPoolSize=10,
+    compressors="zstd,zlib",
+    retryWrites=True,
+    readPreference="primaryPreferred",
+    serverSelectionTimeoutMS=3000
+)
 db = mongo_client[DB_NAME]
-logs_db = db["Logs"]
+# Issue logs are telemetry; acknowledging on the primary alone is enough
+logs_db = db.get_collection("Logs", write_concern=WriteConcern(w=1))
 cars_db = db["vehicles"]
+http_client = httpx.AsyncClient(timeout=30.0)
+
+# ================= CACHES =================
+car_cache = TTLCache(maxsize=10_000, ttl=30)
+capa_logs_cache = TTLCache(maxsize=1_000, ttl=300)
+llm_cache = TTLCache(maxsize=10_000, ttl=3600)
+# Per car model; entries expire so envelopes are relearned from fresh LLM verdicts every hour
+healthy_envelopes = TTLCache(maxsize=1_000, ttl=3600)
+cache_lock = threading.Lock()
 
 # ================= FASTAPI =================
 app = FastAPI()
+logger = get_logger(__name__)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*","https://superb-bubblegum-6c035a.netlify.app/"],
@@ -81,6 +114,12 @@ You must respond ONLY in valid JSON in this exact schema:
 No explanations. No extra text.
 """
 
+BATCH_PROMPT = SYSTEM_PROMPT + """
+You will receive a JSON array of vehicles, each as {"id": number, "sensors": {...}}.
+Respond with a JSON array containing exactly one object per vehicle, using the schema
+above plus an "id" field equal to the vehicle's input id.
+"""
+
 CAPA_PROMPT = """
 You are an automotive quality management AI.
 
@@ -97,48 +136,222 @@ Generate CAPA JSON:
 """
 
 # ================= LLM =================
-def call_llm(prompt):
-    res = client.models.generate_content(
+JSON_FENCE = re.compile(r"^```(?:json)?\s*\n?(.*?)\n?```\s*$", re.DOTALL)
+
+# Built once per static prompt so the hot path never re-encodes or re-hashes them
+LLM_CONFIGS = {
+    prompt: types.GenerateContentConfig(system_instruction=prompt)
+    for prompt in (SYSTEM_PROMPT, BATCH_PROMPT, CAPA_PROMPT)
+}
+LLM_KEY_PREFIXES = {prompt: sha256(prompt.encode()) for prompt in LLM_CONFIGS}
+
+def llm_cache_key(system_prompt, prompt):
+    digest = LLM_KEY_PREFIXES[system_prompt].copy()
+    digest.update(prompt.encode())
+    return digest.hexdigest()
+
+async def generate_json(system_prompt, prompt):
+    res = await client.aio.models.generate_content(
         model=MODEL_NAME,
-        contents=[prompt]
+        contents=[prompt],
+        config=LLM_CONFIGS[system_prompt]
     )
     text = res.text.strip()
-    if text.startswith("```"):
-        text = text.split("```")[1].replace("json", "").strip()
-    return json.loads(text)
+    match = JSON_FENCE.match(text)
+    if match:
+        text = match.group(1)
+    return orjson.loads(text)
+
+async def call_llm(system_prompt, prompt):
+    key = llm_cache_key(system_prompt, prompt)
+    with cache_lock:
+        cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = await generate_json(system_prompt, prompt)
+
+    with cache_lock:
+        llm_cache[key] = result
+    return result
+
+# ================= BATCHING =================
+analysis_queue = asyncio.Queue()
+batch_tasks = set()
+
+async def diagnose(sensors):
+    payload = orjson.dumps(sensors, option=orjson.OPT_SORT_KEYS).decode()
+    with cache_lock:
+        cached = llm_cache.get(llm_cache_key(SYSTEM_PROMPT, payload))
+    if cached is not None:
+        return cached
+
+    future = asyncio.get_running_loop().create_future()
+    await analysis_queue.put((payload, future))
+    return await future
+
+async def run_analysis_batch(batch):
+    # Identical payloads in one window share a single slot in the prompt
+    waiting = {}
+    for payload, future in batch:
+        waiting.setdefault(payload, []).append(future)
+    payloads = list(waiting)
 
-# ================= CORE =================
-def trigger_automated_service(userId, vehicleId, pred):
-    dashboard_res = requests.get(f"{DASHBOARD_API}{userId}")
-    dashboard_data = dashboard_res.json()
+    try:
+        if len(payloads) == 1:
+            results = {0: await call_llm(SYSTEM_PROMPT, payloads[0])}
+        else:
+            prompt = "[" + ",".join(
+                f'{{"id":{i},"sensors":{payload}}}' for i, payload in enumerate(payloads)
+            ) + "]"
+            results = {}
+            for item in await generate_json(BATCH_PROMPT, prompt):
+                results[int(item.pop("id", -1))] = item
+    except Exception as e:
+        for futures in waiting.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        return
 
-    phone = dashboard_data["user_profile"]["phone"]
+    for i, payload in enumerate(payloads):
+        result = results.get(i)
+        if result is not None:
+            with cache_lock:
+                llm_cache[llm_cache_key(SYSTEM_PROMPT, payload)] = result
+        for future in waiting[payload]:
+            if future.done():
+                continue
+            if result is None:
+                future.set_exception(RuntimeError("Missing result in batched LLM response"))
+            else:
+                future.set_result(result)
+
+async def analysis_batcher():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await analysis_queue.get()]
+        deadline = loop.time() + BATCH_MAX_WAIT
+        while len(batch) < BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(analysis_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Gemini latency must not hold up collection of the next batch
+        task = asyncio.create_task(run_analysis_batch(batch))
+        batch_tasks.add(task)
+        task.add_done_callback(batch_tasks.discard)
+
+# ================= HEALTHY ENVELOPE =================
+HEALTHY_RESPONSE = {
+    "status": "HEALTHY",
+    "isServiceNeeded": False,
+    "recommendedAction": "No action needed",
+    "predictions": [],
+    "summary": "All sensor readings are within the normal range observed for this vehicle model."
+}
 
-    payload = {
-        "number": phone,
-        "vehicleId": vehicleId,
-        "issue": pred["issue"]
-    }
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def within_healthy_envelope(model, sensors):
+    with cache_lock:
+        envelope = healthy_envelopes.get(model)
+        if envelope is None or envelope["samples"] < HEALTHY_MIN_SAMPLES:
+            return False
+        bounds = envelope["bounds"]
+        # A reading that omits any learned sensor can't be vouched for
+        if sensors.keys() != bounds.keys():
+            return False
+        for key, value in sensors.items():
+            if not is_number(value):
+                return False
+            low, high = bounds[key]
+            if not low <= value <= high:
+                return False
+    return True
+
+def learn_healthy_envelope(model, sensors):
+    if not sensors or not all(is_number(value) for value in sensors.values()):
+        return
 
-    requests.post(SERVICE_API, json=payload)
+    # Verdicts replayed from the LLM cache must not count as extra samples, so only distinct readings do
+    digest = sha256(orjson.dumps(sensors, option=orjson.OPT_SORT_KEYS)).digest()
+    with cache_lock:
+        envelope = healthy_envelopes.get(model)
+        if envelope is None:
+            envelope = healthy_envelopes[model] = {"samples": 0, "bounds": {}, "seen": set()}
+        seen = envelope["seen"]
+        if envelope["samples"] < HEALTHY_MIN_SAMPLES:
+            if digest in seen:
+                return
+            seen.add(digest)
+        bounds = envelope["bounds"]
+        for key, value in sensors.items():
+            if key in bounds:
+                low, high = bounds[key]
+                bounds[key] = (min(low, value), max(high, value))
+            else:
+                bounds[key] = (value, value)
+        envelope["samples"] += 1
+        if envelope["samples"] >= HEALTHY_MIN_SAMPLES:
+            seen.clear()
 
-def process_vehicle_analysis(userId, vehicleId, sensors):
-    car_doc = cars_db.find_one({
+# ================= CORE =================
+async def get_car(userId, vehicleId):
+    key = (userId, vehicleId)
+    with cache_lock:
+        car_doc = car_cache.get(key)
+    if car_doc is not None:
+        return car_doc
+
+    car_doc = await cars_db.find_one({
         "user_id": userId,
         "vehicle_id": vehicleId
     })
+    if car_doc:
+        with cache_lock:
+            car_cache[key] = car_doc
+    return car_doc
+
+async def trigger_automated_service(userId, vehicleId, pred):
+    try:
+        dashboard_res = await http_client.get(f"{DASHBOARD_API}{userId}")
+        dashboard_data = dashboard_res.json()
+
+        phone = dashboard_data["user_profile"]["phone"]
+
+        payload = {
+            "number": phone,
+            "vehicleId": vehicleId,
+            "issue": pred["issue"]
+        }
+
+        await http_client.post(SERVICE_API, json=payload)
+    except Exception as e:
+        logger.error("Service trigger failed: %s", e)
+
+async def process_vehicle_analysis(userId, vehicleId, sensors, background_tasks):
+    car_doc = await get_car(userId, vehicleId)
 
     if not car_doc:
         raise ValueError("Car not found")
 
-    llm_output = call_llm(SYSTEM_PROMPT + json.dumps(sensors))
+    model = car_doc.get("model")
+    if model and within_healthy_envelope(model, sensors):
+        llm_output = HEALTHY_RESPONSE
+    else:
+        llm_output = await diagnose(sensors)
+        if model and not llm_output.get("isServiceNeeded") and not llm_output.get("predictions"):
+            learn_healthy_envelope(model, sensors)
     predictions = llm_output.get("predictions", [])
 
-    updated_car_doc = {
-        "user_id": car_doc["user_id"],
-        "vehicle_id": car_doc["vehicle_id"],
-        "owner": car_doc.get("owner", "Unknown"),
-        "model": car_doc.get("model", "Unknown"),
+    # Only the analysis is written; identity and owner fields belong to whoever manages the car record
+    analysis = {
         "status": llm_output.get("status"),
         "isServiceNeeded": llm_output.get("isServiceNeeded"),
         "recommendedAction": llm_output.get("recommendedAction"),
@@ -147,173 +360,219 @@ def process_vehicle_analysis(userId, vehicleId, sensors):
         "summary": llm_output.get("summary")
     }
 
-    cars_db.update_one(
-        {"_id": car_doc["_id"]},
-        {"$set": updated_car_doc}
+    update = cars_db.find_one_and_update(
+        {"user_id": userId, "vehicle_id": vehicleId},
+        {"$set": analysis},
+        return_document=ReturnDocument.AFTER
     )
 
-    total_certainty = 0
-    max_certainty = 0
-    top_issue = None
-
-    for pred in predictions:
-        logs_db.insert_one({
-            "logId": str(uuid4()),
-            "userId": userId,
-            "vehicleId": vehicleId,
-            "timestamp": datetime.utcnow(),
-            "logType": "ISSUE",
-            "data": pred
-        })
+    if predictions:
+        # The car update and the log insert touch different collections, so run them together
+        now = datetime.utcnow()
+        company = get_company_from_vehicle(vehicleId)
+        car_doc, _ = await asyncio.gather(update, logs_db.insert_many([
+            {
+                "logId": uuid4().hex,
+                "userId": userId,
+                "vehicleId": vehicleId,
+                "company": company,
+                "timestamp": now,
+                "logType": "ISSUE",
+                "data": pred
+            }
+            for pred in predictions
+        ], ordered=False))
+    else:
+        car_doc = await update
 
-        certainty = pred.get("prediction", {}).get("certainty", 0)
-        total_certainty += certainty
+    with cache_lock:
+        if car_doc:
+            car_cache[(userId, vehicleId)] = car_doc
+        else:
+            car_cache.pop((userId, vehicleId), None)
 
-        if certainty > max_certainty:
-            max_certainty = certainty
-            top_issue = pred
+    if not car_doc:
+        raise ValueError("Car not found")
 
     if not predictions:
         return
 
-    avg_certainty = total_certainty / len(predictions)
+    certainties = [pred.get("prediction", {}).get("certainty", 0) for pred in predictions]
+    max_certainty = max(certainties)
+    top_issue = predictions[certainties.index(max_certainty)] if max_certainty > 0 else None
+
+    avg_certainty = sum(certainties) / len(predictions)
     THRESHOLD = 0.65
 
     if avg_certainty > THRESHOLD and top_issue:
-        print("Triggered Calling")
-        trigger_automated_service(userId, vehicleId, top_issue)
+        logger.info("Triggered calling for %s", vehicleId)
+        background_tasks.add_task(trigger_automated_service, userId, vehicleId, top_issue)
         
-    updated_car_doc["_id"] = str(car_doc["_id"])
-    return updated_car_doc
+    return {
+        "user_id": car_doc["user_id"],
+        "vehicle_id": car_doc["vehicle_id"],
+        "owner": car_doc.get("owner", "Unknown"),
+        "model": car_doc.get("model", "Unknown"),
+        **{key: car_doc.get(key) for key in analysis},
+        "_id": str(car_doc["_id"])
+    }
 
 ##########################=========================================###########################################
 def get_company_from_vehicle(vehicle_id: str):
     return vehicle_id.split("_")[0]
 
-def generate_capa_with_llm(logs: list, company: str):
-    prompt = CAPA_PROMPT + "\nCompany: " + company + "\nLogs:\n" + json.dumps(logs)
-    print("capa generated")
-    return call_llm(prompt)
+async def fetch_capa_logs(company: str):
+    # Collapse repeated issues server-side so the prompt grows with distinct issues, not log volume
+    cursor = await logs_db.aggregate([
+        {"$match": {"company": company, "logType": "ISSUE"}},
+        {"$group": {
+            "_id": {
+                "component": "$data.component",
+                "issue": "$data.issue",
+                "severity": "$data.severity"
+            },
+            "count": {"$sum": 1},
+            "avg_certainty": {"$avg": "$data.prediction.certainty"},
+            "min_days_left": {"$min": "$data.prediction.days_left"},
+            "sample_recommendation": {"$first": "$data.recommendation"}
+        }},
+        {"$project": {
+            "_id": 0,
+            "component": "$_id.component",
+            "issue": "$_id.issue",
+            "severity": "$_id.severity",
+            "count": 1,
+            "avg_certainty": 1,
+            "min_days_left": 1,
+            "sample_recommendation": 1
+        }},
+        {"$sort": {"count": -1}}
+    ])
+    return await cursor.to_list(None)
+
+async def generate_capa_with_llm(logs: list, company: str):
+    prompt = "Company: " + company + "\nIssue summary (grouped, with occurrence counts):\n" + orjson.dumps(logs).decode()
+    logger.debug("Generating CAPA for %s", company)
+    return await call_llm(CAPA_PROMPT, prompt)
 
 # ================= PDF =================
+PDF_STYLES = getSampleStyleSheet()
+PDF_TITLE = ParagraphStyle("CapaTitle", parent=PDF_STYLES["Heading1"], fontSize=16)
+PDF_HEADING = ParagraphStyle("CapaHeading", parent=PDF_STYLES["Heading3"], fontSize=12)
+PDF_BODY = ParagraphStyle("CapaBody", parent=PDF_STYLES["Normal"], fontSize=10, leftIndent=15, spaceAfter=6)
+
 def create_capa_pdf_from_llm(capa_data: dict):
-    tmp_dir = tempfile.gettempdir()
-    filename = f"{tmp_dir}/CAPA_{capa_data['company']}.pdf"
-
-    c = canvas.Canvas(filename, pagesize=A4)
-    width, height = A4
-    x, y = 50, height - 50
-    max_width = 90  # characters per line (controls wrapping)
-
-    def draw_block(title, items):
-        nonlocal y
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(x, y, title)
-        y -= 20
-
-        c.setFont("Helvetica", 10)
-        for item in items:
-            wrapped = wrap(item, max_width)
-            for line in wrapped:
-                c.drawString(x + 15, y, f"- {line}")
-                y -= 14
-            y -= 6  # extra spacing between bullets
-        y -= 10
-
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(x, y, "CAPA REPORT")
-    y -= 30
-    c.setFont("Helvetica", 11)
-    c.drawString(x, y, f"Company: {capa_data['company']}")
-    y -= 40
-
-    draw_block("Root Causes", capa_data["root_causes"])
-    draw_block("Corrective Actions", capa_data["corrective_actions"])
-    draw_block("Preventive Actions", capa_data["preventive_actions"])
-
-    # Risk Assessment
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(x, y, "Risk Assessment:")
-    y -= 20
-    c.setFont("Helvetica", 10)
-    for line in wrap(capa_data["risk_assessment"], max_width):
-        c.drawString(x + 15, y, line)
-        y -= 14
-
-    y -= 30
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(x, y, "Summary:")
-    y -= 20
-    c.setFont("Helvetica", 10)
-    for line in wrap(capa_data["summary"], max_width):
-        c.drawString(x + 15, y, line)
-        y -= 14
-
-    c.save()
-    return filename
+    def block(title, items):
+        return [
+            Paragraph(title, PDF_HEADING),
+            *[Paragraph(f"- {escape(str(item))}", PDF_BODY) for item in items],
+            Spacer(1, 10)
+        ]
+
+    flowables = [
+        Paragraph("CAPA REPORT", PDF_TITLE),
+        Paragraph(f"Company: {escape(capa_data['company'])}", PDF_STYLES["Normal"]),
+        Spacer(1, 20),
+        *block("Root Causes", capa_data["root_causes"]),
+        *block("Corrective Actions", capa_data["corrective_actions"]),
+        *block("Preventive Actions", capa_data["preventive_actions"]),
+        Paragraph("Risk Assessment:", PDF_HEADING),
+        Paragraph(escape(capa_data["risk_assessment"]), PDF_BODY),
+        Spacer(1, 20),
+        Paragraph("Summary:", PDF_HEADING),
+        Paragraph(escape(capa_data["summary"]), PDF_BODY)
+    ]
+
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=A4, leftMargin=50, rightMargin=50, topMargin=50, bottomMargin=50).build(flowables)
+    return buffer.getvalue()
+
+def pdf_content_disposition(filename):
+    # Same encoding as Starlette's FileResponse: names that aren't plain ASCII go in RFC 5987 form
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
 
 # ================= API =================
 @app.get("/")
-def health_check():
+def health_check() -> dict:
     return {"status": "running", "db": DB_NAME}
 
+async def prepare_database():
+    # Runs in the background: an unreachable Mongo or a long backfill must not hold up startup
+    try:
+        await logs_db.create_index([("company", 1), ("logType", 1)])
+        await cars_db.create_index([("user_id", 1), ("vehicle_id", 1)])
+        # Backfill logs written before the company field existed; matches nothing once done
+        result = await logs_db.update_many(
+            {"company": {"$exists": False}},
+            [{"$set": {"company": {"$arrayElemAt": [{"$split": ["$vehicleId", "_"]}, 0]}}}]
+        )
+        if result.modified_count:
+            logger.info("Backfilled company on %d logs", result.modified_count)
+    except Exception as e:
+        logger.exception("Database setup failed: %s", e)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.db_setup = asyncio.create_task(prepare_database())
+    app.state.batcher = asyncio.create_task(analysis_batcher())
+
+@app.on_event("shutdown")
+async def shutdown_clients():
+    app.state.db_setup.cancel()
+    app.state.batcher.cancel()
+    await http_client.aclose()
+    await mongo_client.close()
+
 @app.post("/analyze")
-def analyze_vehicle_endpoint(payload: VehicleRequest):
+async def analyze_vehicle_endpoint(payload: VehicleRequest, background_tasks: BackgroundTasks) -> dict | None:
     try:
-        return process_vehicle_analysis(
+        return await process_vehicle_analysis(
             payload.userId,
             payload.vehicleId,
-            payload.sensors
+            payload.sensors,
+            background_tasks
         )
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        print("SERVER ERROR:", e)
+        logger.exception("Analysis failed: %s", e)
         raise HTTPException(status_code=500, detail="LLM Failure")
 
 @app.get("/capa/{vehicle_id}")
-def generate_company_capa_from_vehicle(vehicle_id: str):
+async def generate_company_capa_from_vehicle(vehicle_id: str):
     try:
         company = get_company_from_vehicle(vehicle_id)
-        regex = f"{company}_"
-        print("Regex:", regex)
 
-        issue_logs = list(logs_db.find({
-            "vehicleId": {"$regex": regex},
-            "logType": "ISSUE"
-        }))
+        with cache_lock:
+            clean_logs = capa_logs_cache.get(company)
 
-        print("Logs count:", len(issue_logs))
+        if clean_logs is None:
+            clean_logs = await fetch_capa_logs(company)
 
-        if not issue_logs:
-            raise HTTPException(404, "No ISSUE logs found for this company")
+            logger.debug("CAPA issue groups for %s: %d", company, len(clean_logs))
 
-        clean_logs = [
-            {
-                "component": log["data"]["component"],
-                "issue": log["data"]["issue"],
-                "severity": log["data"]["severity"],
-                "prediction": log["data"]["prediction"],
-                "recommendation": log["data"]["recommendation"]
-            }
-            for log in issue_logs
-        ]
+            if not clean_logs:
+                raise HTTPException(404, "No ISSUE logs found for this company")
 
-        capa_json = generate_capa_with_llm(clean_logs, company)
-        pdf_path = create_capa_pdf_from_llm(capa_json)
+            with cache_lock:
+                capa_logs_cache[company] = clean_logs
 
-        print("PDF path:", pdf_path)
+        capa_json = await generate_capa_with_llm(clean_logs, company)
+        pdf_bytes = await run_in_threadpool(create_capa_pdf_from_llm, capa_json)
 
-        return FileResponse(
-            pdf_path,
-            filename=f"{company}_GLOBAL_CAPA.pdf",
-            media_type="application/pdf"
+        return Response(
+            pdf_bytes,
+            media_type="application/pdf",
+            headers={"Content-Disposition": pdf_content_disposition(f"{company}_GLOBAL_CAPA.pdf")}
         )
 
     except Exception as e:
-        print("CAPA ERROR:", str(e))
+        logger.exception("CAPA generation failed: %s", e)
         raise HTTPException(500, str(e))
 # ================= RUN =================
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop", http="httptools")
@@ -1,12 +1,17 @@
 import time
-import threading
-import requests
+import logging
+import random
+import asyncio
+import aiohttp
+import ijson
 from fastapi import FastAPI
-from datetime import datetime, timedelta, timezone
-from collections import defaultdict
+from datetime import datetime, timezone
 from fastapi.middleware.cors import CORSMiddleware
+from ueba import UebaState, BOOKING_BURST_WINDOW, render
+from log_config import get_logger
 
 app = FastAPI(title="EY Intelligent Master Supervisor")
+logger = get_logger("master", "INFO")
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,189 +35,240 @@ SERVICES = {
 }
 
 FETCH_INTERVAL = 60
-
-cached_logs = []
-security_alerts = []
+# A dead host fails on connect after 1s instead of waiting out the full timeout
+PROBE_TIMEOUT = aiohttp.ClientTimeout(total=5, sock_connect=1)
+LOGS_TIMEOUT = aiohttp.ClientTimeout(total=10, sock_connect=1)
+FORCE_SCAN_MIN_INTERVAL = 5  # debounce for /status?force=true
+PROBE_JITTER = 5  # seconds either side of FETCH_INTERVAL between probes of one service
+CIRCUIT_OPEN_AFTER = 2  # consecutive DOWN probes before a service is skipped
+CIRCUIT_MAX_BACKOFF = 300  # seconds
+INGEST_CHUNK = 500  # streamed logs are folded into UEBA state this many at a time
+
+security_alerts = set()  # alert tuples; rendered to text only when served
+# Built incrementally: each fetch only ingests logs appended since the last one
+ueba_state = UebaState()
 health_status = {}
+http_session = None
+head_unsupported = set()  # services whose probe URL answers HEAD with 405/501
+circuit_state = {}
+log_validators = {}  # ETag / Last-Modified of the last logs payload ingested
+last_scan_ts = None
+last_forced_scan = 0.0
+scan_lock = asyncio.Lock()
 
 # HEALTH CHECK 
 
-def check_health():
-    global health_status
-    print("\n===== HEALTH CHECK =====")
-
-    status_report = {}
+def probe_result(status):
+    return "ONLINE" if status == 200 else f"ERROR {status}"
 
-    for name, url in SERVICES.items():
-        try:
-            r = requests.get(url, timeout=5)
-            if r.status_code == 200:
-                status_report[name] = "ONLINE"
-            else:
-                status_report[name] = f"ERROR {r.status_code}"
-        except:
-            status_report[name] = "DOWN"
+async def send_probe(name, url):
+    try:
+        if name not in head_unsupported:
+            async with http_session.head(url, timeout=PROBE_TIMEOUT, allow_redirects=True) as r:
+                status = r.status
+            if status not in (405, 501):
+                return probe_result(status)
+            head_unsupported.add(name)
+
+        # Route has no HEAD handler: fall back to GET but only look at the status line
+        async with http_session.get(url, timeout=PROBE_TIMEOUT) as r:
+            return probe_result(r.status)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return "DOWN"
+
+async def probe_service(name, url):
+    # Circuit breaker: after CIRCUIT_OPEN_AFTER consecutive DOWN probes skip the service for a backoff
+    # that doubles per probe period; the jitter margin makes sure the next scheduled probe is covered
+    circuit = circuit_state.setdefault(name, {"fails": 0, "skip_until": 0.0})
+    if time.monotonic() < circuit["skip_until"]:
+        return "DOWN (circuit open)"
+
+    status = await send_probe(name, url)
+    if status == "DOWN":
+        circuit["fails"] += 1
+        if circuit["fails"] >= CIRCUIT_OPEN_AFTER:
+            backoff = FETCH_INTERVAL * 2 ** (circuit["fails"] - CIRCUIT_OPEN_AFTER) + PROBE_JITTER
+            circuit["skip_until"] = time.monotonic() + min(CIRCUIT_MAX_BACKOFF, backoff)
+    else:
+        circuit["fails"] = 0
+        circuit["skip_until"] = 0.0
+    return status
+
+async def check_health():
+    logger.debug("Health check sweep started")
+
+    # Probe every service at once so a sweep takes as long as the slowest one
+    results = await asyncio.gather(*[probe_service(name, url) for name, url in SERVICES.items()])
+    status_report = dict(zip(SERVICES, results))
+
+    for name, status in status_report.items():
+        logger.debug("%s → %s", name, status)
+
+    health_status.update(status_report)
 
-        print(f"{name} → {status_report[name]}")
+# -FETCH LOGS  #
 
-    health_status = status_report
+def reset_logs_state():
+    # Validators must go with the state, otherwise a 304 would leave the rebuilt state empty
+    log_validators.clear()
+    ueba_state.reset()
 
-# -FETCH LOGS  #
+async def fetch_logs():
+    logger.debug("Fetching logs")
 
-def fetch_logs():
-    global cached_logs
-    print("\n===== FETCHING LOGS =====")
+    headers = {}
+    if "etag" in log_validators:
+        headers["If-None-Match"] = log_validators["etag"]
+    if "last_modified" in log_validators:
+        headers["If-Modified-Since"] = log_validators["last_modified"]
 
+    window_start = datetime.now(timezone.utc) - BOOKING_BURST_WINDOW
+    offset = ueba_state.ingested_count
+    position = 0
     try:
-        response = requests.get(LOGS_API, timeout=10)
-
-        if response.status_code == 200:
-            data = response.json()
-            if isinstance(data, list):
-                cached_logs = data
-                print(f"Fetched {len(cached_logs)} logs successfully")
-            else:
-                print("Logs API returned non-list response")
-                cached_logs = []
-        else:
-            print("Failed to fetch logs:", response.status_code)
-            cached_logs = []
-    except Exception as e:
-        print("Error fetching logs:", e)
-        cached_logs = []
+        async with http_session.get(LOGS_API, timeout=LOGS_TIMEOUT, headers=headers) as response:
+            if response.status == 304:
+                logger.debug("Logs unchanged since last fetch")
+                return
+            if response.status != 200:
+                logger.warning("Failed to fetch logs: %s", response.status)
+                reset_logs_state()
+                return
+
+            log_validators.clear()
+            if "ETag" in response.headers:
+                log_validators["etag"] = response.headers["ETag"]
+            if "Last-Modified" in response.headers:
+                log_validators["last_modified"] = response.headers["Last-Modified"]
+
+            # Parse the array straight off the socket; raw logs are never held beyond one chunk
+            chunk = []
+            async for log in ijson.items(response.content, "item", use_float=True):
+                position += 1
+                if position <= offset:
+                    continue
+                chunk.append(log)
+                if len(chunk) == INGEST_CHUNK:
+                    ueba_state.ingest(chunk, window_start)
+                    chunk = []
+            ueba_state.ingest(chunk, window_start)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ijson.JSONError) as e:
+        logger.warning("Error fetching logs: %s", e)
+        reset_logs_state()
+        return
+
+    # The logs API is append-only; a shorter list means it was reset, so rebuild from scratch
+    if position < offset:
+        reset_logs_state()
+        return await fetch_logs()
+
+    logger.info("Fetched %d logs successfully (%d new)", position, position - offset)
 
 # - UEBA ENGINE #
 
 def run_ueba_analysis():
     global security_alerts
-    print("\n===== RUNNING UEBA ANALYSIS =====")
-
-    alerts = []
+    logger.debug("Running UEBA analysis")
 
-    if not cached_logs:
-        print("No logs available for analysis")
-        security_alerts = []
+    if not ueba_state.ingested_count:
+        logger.info("No logs available for analysis")
+        security_alerts = set()
         return
 
-    now = datetime.now(timezone.utc)
-    five_minutes_ago = now - timedelta(minutes=5)
-    seven_days_ago = now - timedelta(days=7)
+    alerts, active_users = ueba_state.evaluate(datetime.now(timezone.utc))
 
-    user_booking_count = defaultdict(int)
-    vehicle_users = defaultdict(set)
-    issue_records = {}
-    booking_records = []
+    logger.info("UEBA analyzed %d active users, %d vehicles", active_users, len(ueba_state.vehicle_users))
 
-    for log in cached_logs:
-        try:
-            log_time = datetime.fromisoformat(
-                log["timestamp"].replace("Z", "+00:00")
-            )
-        except:
-            continue
-
-        user = log["userId"]
-        vehicle = log["vehicleId"]
-        log_type = log["logType"]
-        data = log.get("data", {})
-
-        vehicle_users[vehicle].add(user)
-
-        if log_type == "ISSUE":
-            issue_records[(user, vehicle)] = {
-                "time": log_time,
-                "severity": data.get("severity"),
-                "certainty": data.get("prediction", {}).get("certainty", 100)
-            }
-
-        if log_type == "BOOKING":
-            booking_records.append((user, vehicle, log_time))
-            if log_time > five_minutes_ago:
-                user_booking_count[user] += 1
-
-    print(f"Users analyzed: {len(user_booking_count)}")
-    print(f"Vehicles analyzed: {len(vehicle_users)}")
-
- 
-    for user, count in user_booking_count.items():
-        if count > 3:
-            msg = f"Anomaly: {user} created {count} bookings in 5 minutes"
-            print("ALERT →", msg)
-            alerts.append(msg)
-
-   
-    for user, vehicle, _ in booking_records:
-        if (user, vehicle) not in issue_records:
-            msg = f"Suspicious: {user} booked {vehicle} without ISSUE record"
-            print("ALERT →", msg)
-            alerts.append(msg)
-
-    
-    for vehicle, users in vehicle_users.items():
-        if len(users) > 1:
-            msg = f"Ownership anomaly: Vehicle {vehicle} used by multiple users"
-            print("ALERT →", msg)
-            alerts.append(msg)
-
-    
-    for (user, vehicle), issue in issue_records.items():
-        if issue["severity"] == "HIGH":
-            if issue["time"] < seven_days_ago:
-                booked = any(
-                    u == user and v == vehicle
-                    for u, v, _ in booking_records
-                )
-                if not booked:
-                    msg = f"Risk: HIGH severity issue ignored for {vehicle}"
-                    print("ALERT →", msg)
-                    alerts.append(msg)
-
-    
-    for user, vehicle, _ in booking_records:
-        issue = issue_records.get((user, vehicle))
-        if issue and issue["certainty"] < 50:
-            msg = f"Suspicious: {user} booked {vehicle} despite low certainty"
-            print("ALERT →", msg)
-            alerts.append(msg)
+    if logger.isEnabledFor(logging.WARNING):
+        for alert in alerts:
+            logger.warning("ALERT → %s", render(alert))
 
     if not alerts:
-        print("No anomalies detected")
+        logger.info("No anomalies detected")
 
-    security_alerts = list(set(alerts))
+    security_alerts = alerts
 
 # ----- BACKGROUND LOOP 
 
-def monitor_loop():
+async def probe_loop():
+    # Each service gets its own random phase so probes never land on the upstreams in one burst
+    start = time.monotonic()
+    next_probe = {name: start + random.uniform(0, FETCH_INTERVAL) for name in SERVICES}
     while True:
-        print("\n===================================")
-        print("MASTER SUPERVISOR SCAN STARTED")
-        print("Time:", datetime.now(timezone.utc).isoformat())
-        print("===================================")
+        await asyncio.sleep(max(0, min(next_probe.values()) - time.monotonic()))
 
-        check_health()
-        fetch_logs()
-        run_ueba_analysis()
+        now = time.monotonic()
+        due = [name for name, at in next_probe.items() if at <= now]
+        results = await asyncio.gather(*[probe_service(name, SERVICES[name]) for name in due])
+        for name, status in zip(due, results):
+            health_status[name] = status
+            logger.debug("%s → %s", name, status)
+            next_probe[name] = now + FETCH_INTERVAL + random.uniform(-PROBE_JITTER, PROBE_JITTER)
 
-        print("\nScan complete. Sleeping...\n")
-        time.sleep(FETCH_INTERVAL)
+async def run_scan(probe_all=False):
+    global last_scan_ts, security_alerts
+    async with scan_lock:
+        logger.info("Master supervisor scan started")
+
+        try:
+            if probe_all:
+                await check_health()
+            await fetch_logs()
+            run_ueba_analysis()
+        except Exception:
+            # Drop partly ingested state and its alerts so the next scan rebuilds from scratch
+            logger.exception("Master supervisor scan failed")
+            reset_logs_state()
+            security_alerts = set()
+            return False
+        last_scan_ts = time.time()
+        return True
+
+async def monitor_loop():
+    while True:
+        if await run_scan():
+            logger.info("Scan complete, sleeping %ds", FETCH_INTERVAL)
+        await asyncio.sleep(FETCH_INTERVAL)
 
 @app.on_event("startup")
-def start_monitor():
-    threading.Thread(target=monitor_loop, daemon=True).start()
+async def start_monitor():
+    global http_session
+    # One pooled session for every probe and log fetch, so TLS connections are reused across scans
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60)
+    )
+    app.state.prober = asyncio.create_task(probe_loop())
+    app.state.monitor = asyncio.create_task(monitor_loop())
+
+@app.on_event("shutdown")
+async def stop_monitor():
+    tasks = (app.state.prober, app.state.monitor)
+    for task in tasks:
+        task.cancel()
+    # A task that already died holds its exception; collect it so the session still gets closed
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await http_session.close()
 
 #  DASHBOARD - #
 
+# Serves the state kept by the background scan; force=true triggers at most one live scan per FORCE_SCAN_MIN_INTERVAL
 @app.get("/status")
-def dashboard():
+async def dashboard(force: bool = False):
+    global last_forced_scan
+    if force and time.monotonic() - last_forced_scan >= FORCE_SCAN_MIN_INTERVAL:
+        last_forced_scan = time.monotonic()
+        await run_scan(probe_all=True)
+
     return {
         "timestamp": datetime.now(timezone.utc).isoformat(),
+        "age_seconds": round(time.time() - last_scan_ts, 1) if last_scan_ts else None,
         "services_health": health_status,
-        "total_logs_analyzed": len(cached_logs),
-        "security_alerts": security_alerts
+        "total_logs_analyzed": ueba_state.ingested_count,
+        "security_alerts": [render(alert) for alert in security_alerts]
     }
 
 # - MAIN - # 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=9000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=9000, loop="uvloop", http="httptools")
\ No newline at end of file
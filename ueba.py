@@ -0,0 +1,139 @@
+from bisect import insort
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import ciso8601
+
+# Pure UEBA aggregation for master_agent.py. It has no FastAPI/aiohttp imports and is
+# fully annotated so it can be compiled with `mypyc ueba.py`; the compiled extension
+# then shadows this file on import with no change to the caller.
+
+ISSUE = "ISSUE"
+BOOKING = "BOOKING"
+BOOKING_BURST_WINDOW = timedelta(minutes=5)
+BOOKING_BURST_LIMIT = 3
+IGNORED_ISSUE_AGE = timedelta(days=7)
+LOW_CERTAINTY = 50
+MAX_ALERTS = 10_000  # keeps memory bounded if a bad log feed makes every record look anomalous
+
+# (time, severity, certainty) of the latest ISSUE log for a (user, vehicle) pair
+IssueRecord = tuple[datetime, Any, Any]
+# Alerts are kept as (kind, *fields) tuples; duplicates collapse in the set before any string is built
+Alert = tuple[Any, ...]
+
+ALERT_TEMPLATES = {
+    "OWNERSHIP": "Ownership anomaly: Vehicle {} used by multiple users",
+    "BOOKING_BURST": "Anomaly: {} created {} bookings in 5 minutes",
+    "NO_ISSUE": "Suspicious: {} booked {} without ISSUE record",
+    "LOW_CERTAINTY": "Suspicious: {} booked {} despite low certainty",
+    "HIGH_IGNORED": "Risk: HIGH severity issue ignored for {}",
+}
+
+
+def render(alert: Alert) -> str:
+    return ALERT_TEMPLATES[alert[0]].format(*alert[1:])
+
+
+class UebaState:
+    def __init__(self) -> None:
+        self.ingested_count = 0
+        # Ids are typed Any: mypyc would otherwise reject feeds with non-string ids that plain Python accepts
+        self.booking_windows: dict[Any, deque[datetime]] = {}  # user -> sorted booking times
+        self.vehicle_users: dict[Any, set[Any]] = {}
+        self.issue_records: dict[tuple[Any, Any], IssueRecord] = {}
+        self.booked_pairs: set[tuple[Any, Any]] = set()
+        self.ownership_alerts: set[Alert] = set()  # only ever grows with vehicle_users
+
+    def reset(self) -> None:
+        self.ingested_count = 0
+        self.booking_windows.clear()
+        self.vehicle_users.clear()
+        self.issue_records.clear()
+        self.booked_pairs.clear()
+        self.ownership_alerts.clear()
+
+    def ingest(self, logs: list[Any], window_start: datetime) -> None:
+        # State is bound to locals once so the per-log loop only does fast lookups
+        parse_datetime = ciso8601.parse_datetime
+        users_by_vehicle = self.vehicle_users
+        issues = self.issue_records
+        windows = self.booking_windows
+        add_booked_pair = self.booked_pairs.add
+
+        for log in logs:
+            # Malformed records are skipped so one bad log can't stall the whole feed
+            try:
+                log_time = parse_datetime(log["timestamp"])
+                if log_time.tzinfo is None:
+                    # main.py stores datetime.utcnow(), so a timestamp without an offset is UTC
+                    log_time = log_time.replace(tzinfo=timezone.utc)
+                user: Any = log["userId"]
+                vehicle: Any = log["vehicleId"]
+                log_type: Any = log["logType"]
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            users = users_by_vehicle.get(vehicle)
+            if users is None:
+                users = users_by_vehicle[vehicle] = set()
+            if user not in users:
+                users.add(user)
+                if len(users) == 2 and len(self.ownership_alerts) < MAX_ALERTS:
+                    self.ownership_alerts.add(("OWNERSHIP", vehicle))
+
+            if log_type == ISSUE:
+                data = log.get("data") or {}
+                prediction = data.get("prediction") or {}
+                certainty = prediction.get("certainty")
+                if not isinstance(certainty, (int, float)) or isinstance(certainty, bool):
+                    certainty = 100
+                issues[(user, vehicle)] = (log_time, data.get("severity"), certainty)
+            elif log_type == BOOKING:
+                add_booked_pair((user, vehicle))
+                if log_time > window_start:
+                    window = windows.get(user)
+                    if window is None:
+                        window = windows[user] = deque()
+                    insort(window, log_time)
+
+        self.ingested_count += len(logs)
+
+    def evaluate(self, now: datetime) -> tuple[set[Alert], int]:
+        window_start = now - BOOKING_BURST_WINDOW
+        ignored_before = now - IGNORED_ISSUE_AGE
+        alerts = set(self.ownership_alerts)
+
+        # Slide every user's booking window forward, flagging bursts and dropping idle users
+        windows = self.booking_windows
+        active_users = 0
+        for user in list(windows):
+            window = windows[user]
+            while window and window[0] <= window_start:
+                window.popleft()
+            if not window:
+                del windows[user]
+                continue
+            active_users += 1
+            if len(window) > BOOKING_BURST_LIMIT and len(alerts) < MAX_ALERTS:
+                alerts.add(("BOOKING_BURST", user, len(window)))
+
+        # Issue records are last-write-wins, so booking checks run after ingest rather than inside it
+        issues = self.issue_records
+        for user, vehicle in self.booked_pairs:
+            if len(alerts) >= MAX_ALERTS:
+                break
+            issue = issues.get((user, vehicle))
+            if issue is None:
+                alerts.add(("NO_ISSUE", user, vehicle))
+            elif issue[2] < LOW_CERTAINTY:
+                alerts.add(("LOW_CERTAINTY", user, vehicle))
+
+        for (user, vehicle), (issue_time, severity, _) in issues.items():
+            if len(alerts) >= MAX_ALERTS:
+                break
+            if severity == "HIGH" and issue_time < ignored_before:
+                if (user, vehicle) not in self.booked_pairs:
+                    alerts.add(("HIGH_IGNORED", vehicle))
+
+        return alerts, active_users